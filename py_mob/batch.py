@@ -0,0 +1,65 @@
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from types import SimpleNamespace
+
+from .meas_class import Meas
+from .cache import file_info
+
+
+def get_result(meas, info=None):
+    # only the frames needed by export_gdf are sent back from the workers
+    return SimpleNamespace(
+        fp_csv=meas.fp_csv,
+        id=meas.id,
+        fp=meas.fp,
+        info=info,
+        data=meas.data,
+        extents=meas.extents,
+        path=meas.path,
+        current=meas.current,
+        stats=meas.stats,
+    )
+
+
+def proc_file(fp, **kwargs):
+    crange = kwargs.get("crange", None)
+    try:
+        info = file_info(fp)
+        meas = Meas(fp, **kwargs)
+        if kwargs.get("state", True) == True:
+            meas = meas.Proc_cached(info["data_hash"])
+        else:
+            meas = meas.Proc()
+        if crange != None:
+            meas = meas.Recolor(crange[0], crange[1])
+        meas = meas.Export()
+        meas = meas.Save_state(info["data_hash"], info["hash"])
+        return fp, get_result(meas, info), None
+    except Exception as error:
+        return fp, None, traceback.format_exc()
+
+
+def proc_files(fps, **kwargs):
+    workers = kwargs.get("workers", 1)
+    if workers == None:
+        workers = os.cpu_count()
+
+    if workers > 1:
+        # at most 2 files per worker in flight - finished futures are released
+        # right after their result is yielded, so streaming keeps memory bounded
+        fps = iter(fps)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = {
+                pool.submit(proc_file, fp, **kwargs) for fp in islice(fps, 2 * workers)
+            }
+            while len(pending) > 0:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fp in islice(fps, len(done)):
+                    pending.add(pool.submit(proc_file, fp, **kwargs))
+                while len(done) > 0:
+                    yield done.pop().result()
+    else:
+        for fp in fps:
+            yield proc_file(fp, **kwargs)
@@ -0,0 +1,211 @@
+import os
+import sys
+import time
+import json
+import platform
+import importlib.util
+import numpy as np
+import pandas as pd
+
+from .meas_class import Meas
+from .gridding import kriging, get_grid_mask
+from .database import export_gdf
+from .profiling import profile_stage
+from .cache import PIPELINE_VERSION
+
+CSV_HEADER = "longitude,latitude,voltage,point,attribute,counter,date,hh:mm:ss,cx,cy,cz,lat_int,lon_int,hdop,status,fix,fw,ser"
+
+
+def bench_interpolation(fps, methods=("idw", "linear", "nearest"), **kwargs):
+    rows = []
+    for fp in fps:
+        meas = Meas(fp).Proc()
+        polygon = meas.extents["geometry"].iloc[0]
+
+        t0 = time.perf_counter()
+        grid_x, grid_y, ref = kriging(meas, **kwargs)
+        t_ref = time.perf_counter() - t0
+        mask = get_grid_mask(grid_x[0], grid_y[:, 0], polygon)
+        rows.append({"fp": fp, "method": "kriging", "time": t_ref, "nodes": ref.size})
+
+        # errors are measured against kriging on nodes inside the extents
+        for method in methods:
+            t0 = time.perf_counter()
+            grid_z = kriging(meas, **{**kwargs, "method": method})[2]
+            t = time.perf_counter() - t0
+
+            diff = (grid_z - ref)[mask]
+            diff = diff[~np.isnan(diff)]
+            row = {"fp": fp, "method": method, "time": t, "nodes": grid_z.size}
+            row["speedup"] = t_ref / t
+            row["rmse"] = np.sqrt(np.mean(diff**2))
+            row["mae"] = np.mean(np.abs(diff))
+            row["max_err"] = np.max(np.abs(diff))
+            row["coverage"] = len(diff) / mask.sum()
+            rows.append(row)
+
+    df = pd.DataFrame(rows)
+    if kwargs.get("fp_out", None) != None:
+        save_bench(df, kwargs["fp_out"])
+    return df
+
+
+def save_bench(df, fp, meta=None):
+    if os.path.dirname(fp) != "":
+        os.makedirs(os.path.dirname(fp), exist_ok=True)
+    records = df.to_dict(orient="records")
+    if meta != None:
+        records = {"meta": meta, "results": records}
+    with open(fp, "w") as file:
+        json.dump(records, file, indent=1, default=str)
+
+
+def gen_csv(fp, n, seed=0, header=None, **kwargs):
+    # synthetic datalogger file - walk lines at 1 Hz, 0.5 m apart along and 1 m across
+    rng = np.random.default_rng(seed)
+    lon0, lat0 = kwargs.get("origin", (17.1, 48.15))
+    per_line = kwargs.get("per_line", 100)
+    start = pd.Timestamp(kwargs.get("start", "2000-01-01 00:00:00"))
+    ser = kwargs.get("ser", None)
+    if ser == None:
+        ser = pd.read_csv("py_mob/sensors.tsv", sep="\t")["orig"].iloc[0]
+
+    k = np.arange(n)
+    line = k // per_line
+    forward = line % 2 == 0
+    along = np.where(forward, k % per_line, per_line - 1 - k % per_line) * 0.5
+    across = line * 1.0
+    m_lat = 111320.0
+    m_lon = m_lat * np.cos(np.deg2rad(lat0))
+
+    # smooth background, a few buried anomalies and sensor noise
+    centres = rng.uniform([0, 0], [across.max() + 1, along.max() + 1], (3, 2))
+    voltage = 0.2 * np.sin(across / 3) + 0.02 * rng.normal(size=n)
+    for cx, cy in centres:
+        voltage += 0.5 * np.exp(-((across - cx) ** 2 + (along - cy) ** 2) / 8)
+    voltage[rng.random(n) < 0.005] = np.nan
+
+    meas = pd.DataFrame(
+        {
+            "lon": lon0 + (across + 0.05 * rng.normal(size=n)) / m_lon,
+            "lat": lat0 + (along + 0.05 * rng.normal(size=n)) / m_lat,
+            "voltage": voltage,
+            "attribute": " ",
+            "counter": 0,
+            "heading": np.where(forward, 0.0, 180.0) + 5 * rng.normal(size=n),
+        }
+    )
+
+    # electrodes on both sides of the area, anomalies marked when passed
+    span_lon = (across.max() + 20) / m_lon
+    span_lat = (along.max() + 20) / m_lat
+    inputs = pd.DataFrame(
+        {
+            "lon": [lon0 - 10 / m_lon, lon0 + span_lon],
+            "lat": [lat0 - 10 / m_lat, lat0 + span_lat],
+            "attribute": [" plus", " minus"],
+            "counter": [1, 1],
+        }
+    )
+    passed = [np.argmin((across - cx) ** 2 + (along - cy) ** 2) for cx, cy in centres]
+    anomaly = meas.iloc[passed].assign(
+        voltage=np.nan, attribute=" anomaly", counter=np.arange(1, len(passed) + 1)
+    )
+    anomaly.index = anomaly.index + 0.5
+    df = pd.concat([inputs.set_index(inputs.index - 2.0), meas, anomaly])
+    df = df.sort_index().reset_index(drop=True)
+    df["heading"] = df["heading"].fillna(0)
+
+    n = len(df)
+    dt = start + pd.to_timedelta(np.arange(1, n + 1), unit="s")
+    hdg = np.deg2rad(df["heading"] - 90)
+    df = pd.DataFrame(
+        {
+            "lon": df["lon"].round(7),
+            "lat": df["lat"].round(7),
+            "voltage": df["voltage"].round(4),
+            "point": np.arange(1, n + 1),
+            "attribute": df["attribute"],
+            "counter": df["counter"],
+            "date": dt.strftime("%Y-%m-%d"),
+            "time": dt.strftime("%H:%M:%S"),
+            "cx": (300 * np.cos(hdg) + 20).round(1),
+            "cy": (300 * np.sin(hdg) - 10).round(1),
+            "cz": rng.normal(size=n).round(1),
+            "lat_int": (df["lat"] * 1e7).astype(np.int64),
+            "lon_int": (df["lon"] * 1e7).astype(np.int64),
+            "hdop": rng.uniform(0.6, 1.2, n).round(2),
+            "status": 1,
+            "fix": 4,
+            "fw": 1.2,
+            "ser": ser,
+        }
+    )
+
+    if os.path.dirname(fp) != "":
+        os.makedirs(os.path.dirname(fp), exist_ok=True)
+    with open(fp, "w", newline="") as file:
+        if header != None:
+            file.write(f"{header}\n")
+        file.write(f"{CSV_HEADER}\n")
+        df.to_csv(file, header=False, index=False, na_rep="nan ")
+    return fp
+
+
+def get_bench_meas_kw():
+    # global kriging needs n x n memory - large files are gridded locally.
+    # With the default openpyxl workbook and full html the 1M point file
+    # alone takes well over half an hour, so the fast writers are used
+    meas_kw = {"grid": {"local": True, "tile": 256}, "html": {"mode": "light"}}
+    if importlib.util.find_spec("xlsxwriter") != None:
+        meas_kw["excel"] = {"engine": "xlsxwriter"}
+    return meas_kw
+
+
+def bench_pipeline(sizes=(100, 1_000, 10_000, 100_000), **kwargs):
+    # everything is written below directory - raw files, surveys and layers
+    directory = kwargs.get("directory", "output/bench")
+    meas_kw = kwargs.get("meas", get_bench_meas_kw())
+    rows = []
+    for i, n in enumerate(sizes):
+        start = pd.Timestamp("2000-01-01") + pd.Timedelta(days=i)
+        fp = gen_csv(f"{directory}/raw/bench_{n}.csv", n, seed=i, start=start)
+        meas = Meas(fp, profile=True, output=directory, **meas_kw)
+        meas = meas.Proc().Export()
+        with profile_stage(meas.stats, "export_gdf"):
+            export_gdf(
+                [meas], overwrite="full", crs=meas.crs, directory=f"{directory}/qfield"
+            )
+        for row in meas.stats:
+            rows.append({"n": n, "size": os.path.getsize(fp), **row})
+
+    df = pd.DataFrame(rows)
+    if kwargs.get("fp_out", None) != None:
+        save_bench(df, kwargs["fp_out"], meta=get_bench_meta())
+    return df
+
+
+def get_bench_meta():
+    meta = {
+        "datetime": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "pipeline_version": PIPELINE_VERSION,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+    }
+    return meta
+
+
+def compare_bench(fp_old, fp_new, threshold=1.2):
+    # wall time ratio per size and stage - ratios above threshold are flagged
+    dfs = []
+    for fp in [fp_old, fp_new]:
+        with open(fp) as file:
+            dfs.append(pd.DataFrame(json.load(file)["results"]))
+    df = pd.merge(*dfs, on=["n", "stage"], suffixes=("_old", "_new"))
+    df = df[["n", "stage", "wall_old", "wall_new"]]
+    df["ratio"] = df["wall_new"] / df["wall_old"]
+    df["regression"] = df["ratio"] > threshold
+    return df
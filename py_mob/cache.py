@@ -0,0 +1,323 @@
+import os
+import time
+import json
+import hashlib
+import shutil
+import pandas as pd
+import geopandas as gpd
+import numpy as np
+import shapely
+from types import SimpleNamespace
+from contextlib import contextmanager
+
+PIPELINE_VERSION = "1"
+CACHE_DIR = "cache"
+MANIFEST = os.path.join(CACHE_DIR, "manifest.json")
+
+# processed Meas state - frames are stored as GeoParquet, the rest in meta.json
+STATE_FRAMES = ["data", "extents", "path", "current"]
+STATE_ATTRS = [
+    "skiprows",
+    "id_ser_num",
+    "id_logger",
+    "id_datetime",
+    "id",
+]
+
+
+def file_hash(fp, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(fp, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_hashes(fp, chunk_size=1 << 20):
+    # hash of the whole file and of the data only - the cmin,cmax line is skipped
+    h = hashlib.sha1()
+    h_data = hashlib.sha1()
+    with open(fp, "rb") as file:
+        line = file.readline()
+        h.update(line)
+        if line.strip().startswith(b"long"):
+            h_data.update(line)
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            h.update(chunk)
+            h_data.update(chunk)
+    return h.hexdigest(), h_data.hexdigest()
+
+
+def file_info(fp):
+    stat = os.stat(fp)
+    hash, data_hash = file_hashes(fp)
+    info = {"hash": hash, "data_hash": data_hash}
+    info.update({"mtime": stat.st_mtime, "size": stat.st_size})
+    return info
+
+
+def write_atomic(fp, txt):
+    tmp = f"{fp}.{os.getpid()}.tmp"
+    with open(tmp, "w") as file:
+        file.write(txt)
+    os.replace(tmp, fp)
+
+
+@contextmanager
+def file_lock(fp, timeout=600):
+    # lock file shared by the worker processes, stale locks are broken
+    lock = f"{fp}.lock"
+    os.makedirs(os.path.dirname(lock) or ".", exist_ok=True)
+    while True:
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock) > timeout:
+                    os.remove(lock)
+            except FileNotFoundError:
+                pass
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.remove(lock)
+
+
+def load_manifest(fp=MANIFEST):
+    if not os.path.exists(fp):
+        return {}
+    with open(fp) as file:
+        return json.load(file)
+
+
+def save_manifest(manifest, fp=MANIFEST):
+    os.makedirs(os.path.dirname(fp), exist_ok=True)
+    write_atomic(fp, json.dumps(manifest, indent=1))
+
+
+def get_options(kwargs):
+    # options that change the outputs - json round trip normalizes tuples
+    options = {
+        key: kwargs.get(key, None) for key in ["crange", "grid", "html", "excel"]
+    }
+    return json.loads(json.dumps(options, default=str))
+
+
+def is_current(fp, manifest, **kwargs):
+    entry = manifest.get(fp, None)
+    if entry == None:
+        return False
+    if entry["version"] != PIPELINE_VERSION:
+        return False
+    if entry.get("options", None) != get_options(kwargs):
+        return False
+    for out in entry["outputs"]:
+        if not os.path.exists(out):
+            return False
+    if load_state_meta(entry["data_hash"], entry["hash"]) == None:
+        return False
+
+    stat = os.stat(fp)
+    if stat.st_size != entry["size"]:
+        return False
+    if stat.st_mtime != entry["mtime"]:
+        # touched but possibly unchanged - fall back to the content hash
+        if file_hash(fp) != entry["hash"]:
+            return False
+        entry["mtime"] = stat.st_mtime
+    return True
+
+
+def update_manifest(manifest, result, **kwargs):
+    entry = dict(result.info)
+    entry["version"] = PIPELINE_VERSION
+    entry["options"] = get_options(kwargs)
+    entry["outputs"] = [out for out in result.fp.values() if os.path.exists(out)]
+    manifest[result.fp_csv] = entry
+    return manifest
+
+
+def load_result(manifest, fp):
+    # the saved state is the result - it must belong to this version of the file
+    entry = manifest[fp]
+    meta = load_state_meta(entry["data_hash"], entry["hash"])
+    if meta == None:
+        raise FileNotFoundError(f"no state saved for {fp}")
+    frames = read_state_frames(entry["data_hash"], meta)
+    frames["extents"]["fp"] = fp
+    return SimpleNamespace(
+        fp_csv=fp, id=meta["attrs"]["id"], info=entry, **frames, stats=[]
+    )
+
+
+def prune_manifest(manifest, fps):
+    fps = set(fps)
+    for fp in [fp for fp in manifest if fp not in fps]:
+        del manifest[fp]
+
+    used = {entry.get("data_hash", None) for entry in manifest.values()}
+    dir_path = os.path.join(CACHE_DIR, "state")
+    if os.path.exists(dir_path):
+        for key in os.listdir(dir_path):
+            if key not in used:
+                shutil.rmtree(os.path.join(dir_path, key), ignore_errors=True)
+    return manifest
+
+
+def state_dir(key):
+    return os.path.join(CACHE_DIR, "state", key)
+
+
+def get_state_format():
+    # GeoParquet needs pyarrow - pickle otherwise
+    try:
+        import pyarrow
+
+        return "parquet"
+    except ImportError:
+        return "pkl"
+
+
+def get_grid_options(meas):
+    return json.loads(json.dumps(meas.grid_kw, default=str))
+
+
+def save_state_grid(meas, dir_path):
+    # the grid does not depend on the colours - a recolour reuses it
+    if meas.skip_grid == False:
+        fp = os.path.join(dir_path, "grid.npz")
+        tmp = f"{fp}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as file:
+            np.savez(file, x=meas.grid_x, y=meas.grid_y, z=meas.grid_z)
+        os.replace(tmp, fp)
+
+    outputs = {}
+    for ext in ["grd", "tif", "bln"]:
+        if os.path.exists(meas.fp[ext]):
+            outputs[meas.fp[ext]] = os.stat(meas.fp[ext]).st_mtime_ns
+    return {
+        "options": get_grid_options(meas),
+        "skip": meas.skip_grid,
+        "outputs": outputs,
+    }
+
+
+def save_state(meas, key, hash=None):
+    dir_path = state_dir(key)
+    os.makedirs(dir_path, exist_ok=True)
+    format = get_state_format()
+    for name in STATE_FRAMES:
+        fp = os.path.join(dir_path, f"{name}.{format}")
+        tmp = f"{fp}.{os.getpid()}.tmp"
+        if format == "parquet":
+            getattr(meas, name).to_parquet(tmp)
+        else:
+            pd.to_pickle(getattr(meas, name), tmp)
+        os.replace(tmp, fp)
+
+    grid = meas.grid_state
+    if grid == None and hasattr(meas, "skip_grid"):
+        grid = save_state_grid(meas, dir_path)
+
+    # meta.json is written last - a state without it is never loaded
+    meta = {
+        "version": PIPELINE_VERSION,
+        "hash": hash,
+        "crs": str(meas.crs),
+        "format": format,
+        "attrs": {attr: getattr(meas, attr) for attr in STATE_ATTRS},
+        "ref_angle": float(meas.ref_angle),
+        "ref_pt": shapely.to_wkt(meas.ref_pt, rounding_precision=-1),
+        "grid": grid,
+    }
+    write_atomic(os.path.join(dir_path, "meta.json"), json.dumps(meta, indent=1))
+
+
+def load_state_meta(key, hash=None):
+    fp = os.path.join(state_dir(key), "meta.json")
+    if not os.path.exists(fp):
+        return None
+    with open(fp) as file:
+        meta = json.load(file)
+    if meta["version"] != PIPELINE_VERSION:
+        return None
+    if hash != None and meta["hash"] != hash:
+        return None
+    return meta
+
+
+def read_state_frames(key, meta):
+    frames = {}
+    for name in STATE_FRAMES:
+        fp = os.path.join(state_dir(key), f"{name}.{meta['format']}")
+        if meta["format"] == "parquet":
+            frames[name] = gpd.read_parquet(fp)
+        else:
+            frames[name] = pd.read_pickle(fp)
+    return frames
+
+
+def load_state(meas, key):
+    meta = load_state_meta(key)
+    if meta == None or meta["crs"] != str(meas.crs):
+        return False
+
+    for name, frame in read_state_frames(key, meta).items():
+        setattr(meas, name, frame)
+    for attr, value in meta["attrs"].items():
+        setattr(meas, attr, value)
+    meas.ref_angle = np.float64(meta["ref_angle"])
+    meas.ref_pt = shapely.from_wkt(meta["ref_pt"])
+    return True
+
+
+def load_state_grid(meas, key):
+    # the grid outputs are kept if the options match and nobody touched them
+    meta = load_state_meta(key)
+    if meta == None or meta["crs"] != str(meas.crs) or meta["grid"] == None:
+        return False
+    grid = meta["grid"]
+    if grid["options"] != get_grid_options(meas):
+        return False
+    for ext in ["grd", "tif", "bln"]:
+        fp = meas.fp[ext]
+        if fp in grid["outputs"]:
+            if not os.path.exists(fp) or os.stat(fp).st_mtime_ns != grid["outputs"][fp]:
+                return False
+    if meas.fp["bln"] not in grid["outputs"]:
+        return False
+
+    meas.skip_grid = grid["skip"]
+    if meas.skip_grid == False:
+        with np.load(os.path.join(state_dir(key), "grid.npz")) as arrays:
+            meas.grid_x = arrays["x"]
+            meas.grid_y = arrays["y"]
+            meas.grid_z = arrays["z"]
+    meas.grid_state = grid
+    return True
+
+
+def variogram_fp(key):
+    return os.path.join(CACHE_DIR, "variogram", f"{key}.json")
+
+
+def load_variogram(key):
+    fp = variogram_fp(key)
+    if not os.path.exists(fp):
+        return None
+    with open(fp) as file:
+        return json.load(file)
+
+
+def save_variogram(key, params):
+    fp = variogram_fp(key)
+    os.makedirs(os.path.dirname(fp), exist_ok=True)
+    write_atomic(fp, json.dumps([float(p) for p in params]))
+
+
+def clear_variogram(key):
+    fp = variogram_fp(key)
+    if os.path.exists(fp):
+        os.remove(fp)
@@ -1,4 +1,5 @@
 from plotly.colors import sample_colorscale
+from functools import lru_cache
 import pandas as pd
 import numpy as np
 
@@ -28,6 +29,21 @@ def get_color(value, cmin, cmax, colorscale):
     return clr
 
 
+@lru_cache(maxsize=None)
+def get_color_lut(colorscale, n=1024):
+    # colorscale sampled once - values are then mapped by index
+    clr_rgb = sample_colorscale(colorscale, np.linspace(0, 1, n).tolist())
+    clr_hex = [rgb_to_hex(c) for c in clr_rgb]
+    return np.array(clr_rgb, dtype=object), np.array(clr_hex, dtype=object)
+
+
+def map_colors(values, cmin, cmax, colorscale, n=1024):
+    clr_rgb, clr_hex = get_color_lut(colorscale, n)
+    values = np.clip(np.asarray(values, dtype=float), cmin, cmax)
+    index = np.rint((values - cmin) / (cmax - cmin) * (n - 1)).astype(int)
+    return clr_rgb[index], clr_hex[index]
+
+
 def get_k_clr(df):
     df["clr"] = "#15FF92"
     df.loc[df["voltage_k"] < 0, "clr"] = "#FF10D7"
@@ -1,51 +1,169 @@
 import pandas as pd
 import geopandas as gpd
+import pyogrio
+import sqlite3
 import os
+from contextlib import closing
+from pathlib import Path
 
+LAYERS = {"data": "ID", "extents": "ID_area", "path": "ID_line", "current": "ID_area"}
 
-def export_gdf(meas, overwrite, crs):
+
+def get_layers(m):
+    data = m.data.loc[m.data["attribute"] != "ref"]
+    return {"data": data, "extents": m.extents, "path": m.path, "current": m.current}
+
+
+def export_gdf(meas, overwrite, crs, **kwargs):
+    directory = kwargs.get("directory", "qfield")
+    os.makedirs(directory, exist_ok=True)
+    if kwargs.get("stream", False) == True:
+        return export_gdf_stream(meas, overwrite, crs, directory)
 
     if overwrite == "full":
         keep = "last"
     else:
         keep = overwrite
 
-    data = pd.DataFrame()
-    extents = pd.DataFrame()
-    path = pd.DataFrame()
-    current = pd.DataFrame()
-
+    # frames are collected first and concatenated once per layer
+    layers = {layer: [] for layer in LAYERS}
+    areas = []
     for m in meas:
-        data = pd.concat([data, m.data.set_crs(crs)], axis=0).reset_index(drop=True)
-        extents = pd.concat([extents, m.extents.set_crs(crs)], axis=0).reset_index(
-            drop=True
-        )
-        path = pd.concat([path, m.path.set_crs(crs)], axis=0).reset_index(drop=True)
-        current = pd.concat([current, m.current.set_crs(crs)], axis=0).reset_index(
-            drop=True
-        )
-
-    fps = [f"qfield/{db}.gpkg" for db in ["data", "extents", "path", "current"]]
-    ids = ["ID", "ID_area", "ID_line", "ID_area"]
-    data = data.loc[data["attribute"] != "ref"]
-    dbs = [data, extents, path, current]
-
-    for fp, id, db in zip(fps, ids, dbs):
+        areas.append(m.id)
+        for layer, db in get_layers(m).items():
+            layers[layer].append(db)
+
+    dbs = {}
+    for layer, dfs in layers.items():
+        if len(dfs) > 0:
+            db = pd.concat(dfs, axis=0, ignore_index=True)
+            dbs[layer] = gpd.GeoDataFrame(db, geometry="geometry").set_crs(crs)
+        else:
+            dbs[layer] = gpd.GeoDataFrame(
+                geometry=[], data={LAYERS[layer]: pd.Series(dtype=str)}, crs=crs
+            )
+
+    for layer, id in LAYERS.items():
+        fp = f"{directory}/{layer}.gpkg"
         print(f"exporting\t{fp}")
-        db = pd.DataFrame(db)
         if not os.path.exists(fp):
-            gpd.GeoDataFrame(geometry=[], data={id: []}, crs=crs).to_file(fp)
-        if overwrite == "full":
-            master = gpd.GeoDataFrame(data={id: [None]}, crs=crs, geometry=[None])
-        else:
-            master = gpd.read_file(fp)
-        master = pd.DataFrame(master)
-        master = pd.concat([master, db], axis=0)
-        master = master.drop_duplicates(subset=id, keep=keep).reset_index(drop=True)
-        master = gpd.GeoDataFrame(master, geometry=master["geometry"], crs=crs)
-        master.to_file(fp, engine="pyogrio")
+            gpd.GeoDataFrame(
+                geometry=[], data={id: pd.Series(dtype=str)}, crs=crs
+            ).to_file(fp)
+        if overwrite != "full":
+            upsert_layer(fp, dbs[layer], id, keep, areas)
+            continue
+        # rows without an ID are dropped as in upsert_layer, so both modes agree
+        db = dbs[layer].dropna(subset=id).drop_duplicates(subset=id, keep=keep)
+        db.reset_index(drop=True).to_file(fp, engine="pyogrio")
+        index_layer(fp, id)
 
     # df = data.groupby("ID_line")["line_hdg_fwd"].agg("median")
     # path = pd.merge(path, df, how="left", left_on="ID_line", right_index=True)
     # path.to_file("tmp/test.gpkg")
-    return data, extents, path
+    return dbs["data"], dbs["extents"], dbs["path"]
+
+
+def export_gdf_stream(meas, overwrite, crs, directory="qfield"):
+    fps = {layer: f"{directory}/{layer}.gpkg" for layer in LAYERS}
+    os.makedirs(directory, exist_ok=True)
+
+    if overwrite == "full":
+        keep = "last"
+        for fp in fps.values():
+            if os.path.exists(fp):
+                os.remove(fp)
+    else:
+        keep = overwrite
+
+    # each measurement is written as soon as it arrives and then released
+    for m in meas:
+        print(f"exporting\t{m.id}")
+        for layer, db in get_layers(m).items():
+            db = gpd.GeoDataFrame(db, geometry="geometry").set_crs(crs)
+            upsert_layer(fps[layer], db, LAYERS[layer], keep, [m.id])
+
+    for layer, fp in fps.items():
+        if not os.path.exists(fp):
+            gpd.GeoDataFrame(
+                geometry=[], data={LAYERS[layer]: pd.Series(dtype=str)}, crs=crs
+            ).to_file(fp)
+
+
+def sql_type(dtype):
+    if pd.api.types.is_bool_dtype(dtype):
+        return "BOOLEAN"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "DATETIME"
+    return "TEXT"
+
+
+def index_layer(fp, id, con=None):
+    table = Path(fp).stem
+    sql = f'CREATE INDEX IF NOT EXISTS "idx_{table}_{id}" ON "{table}" ("{id}")'
+    if con == None:
+        with closing(sqlite3.connect(fp)) as con:
+            with con:
+                con.execute(sql)
+    else:
+        con.execute(sql)
+
+
+def upsert_layer(fp, db, id, keep, areas=None):
+    # with keep="last" all old rows of the incoming areas are replaced, also
+    # those a reprocessed area no longer produces
+    db = db.dropna(subset=id).drop_duplicates(subset=id, keep=keep)
+    if areas == None or keep != "last":
+        areas = []
+    if len(db) == 0 and len(areas) == 0:
+        return
+    if not os.path.exists(fp) or pyogrio.read_info(fp)["features"] == 0:
+        if len(db) == 0:
+            return
+        db.to_file(fp, engine="pyogrio")
+        index_layer(fp, id)
+        return
+
+    table = Path(fp).stem
+    ids = db[id].astype(str).tolist()
+    with closing(sqlite3.connect(fp)) as con:
+        with con:
+            index_layer(fp, id, con)
+            con.execute("CREATE TEMP TABLE incoming (id TEXT PRIMARY KEY)")
+            con.executemany("INSERT OR IGNORE INTO incoming VALUES (?)", zip(ids))
+            con.execute("CREATE TEMP TABLE areas (id TEXT PRIMARY KEY)")
+            con.executemany("INSERT OR IGNORE INTO areas VALUES (?)", zip(areas))
+
+            if keep == "first":
+                sql = f'SELECT "{id}" FROM "{table}" WHERE "{id}" IN incoming'
+                existing = [row[0] for row in con.execute(sql)]
+                db = db.loc[~db[id].astype(str).isin(existing)]
+
+            fields = [row[1] for row in con.execute(f'PRAGMA table_info("{table}")')]
+            for col in db.columns:
+                if col not in fields and col != "geometry":
+                    dtype = sql_type(db[col].dtype)
+                    con.execute(f'ALTER TABLE "{table}" ADD COLUMN "{col}" {dtype}')
+            sql = f'SELECT COALESCE(MAX(fid), 0) FROM "{table}"'
+            max_fid = con.execute(sql).fetchone()[0]
+
+        if len(db) > 0:
+            # pyogrio appends by field position - align to the layer schema
+            fields = list(pyogrio.read_info(fp, layer=table)["fields"])
+            db = db.reindex(columns=fields + ["geometry"])
+            db.to_file(fp, layer=table, engine="pyogrio", mode="a")
+
+        # old rows are only removed once the new ones are written - IDs of an
+        # area are "<ID_area>" or "<ID_area>_<n>", the range keeps the index
+        if keep == "last":
+            sql = (
+                f'DELETE FROM "{table}" WHERE fid <= ? AND ("{id}" IN incoming '
+                f'OR "{id}" IN areas OR fid IN (SELECT t.fid FROM areas JOIN "{table}" t '
+                f"ON t.\"{id}\" >= areas.id || '_' AND t.\"{id}\" < areas.id || '`'))"
+            )
+            with con:
+                con.execute(sql, (max_fid,))
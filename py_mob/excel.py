@@ -0,0 +1,64 @@
+import pandas as pd
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def get_excel_cols():
+    # column order of the exported tables, read once per process
+    cols = pd.read_csv("py_mob/cols_excel.tsv", sep="\t").iloc[:, 0]
+    return tuple(cols)
+
+
+def get_sheets(data):
+    sheets = {
+        "meas": data.loc[data["attribute"] == "meas"],
+        "anomaly": data.loc[data["attribute"] == "anomaly"],
+        "area": data.loc[data["attribute"] == "area"],
+        "input": data.loc[data["attribute"].isin(["minus", "plus"])],
+    }
+    return sheets
+
+
+def get_cell_values(sr):
+    # plain python values - NaN/NaT become empty cells, objects are written as text
+    mask = sr.isna().to_numpy()
+    if (
+        pd.api.types.is_datetime64_any_dtype(sr)
+        or pd.api.types.is_bool_dtype(sr)
+        or pd.api.types.is_numeric_dtype(sr)
+    ):
+        values = sr.astype(object).to_numpy()
+    else:
+        values = pd.Series([str(value) for value in sr], dtype=object).to_numpy()
+    values[mask] = None
+    return values.tolist()
+
+
+def export_excel_xlsxwriter(sheets, fp):
+    import xlsxwriter
+
+    # constant_memory flushes every finished row - rows must be written in order
+    with xlsxwriter.Workbook(fp, {"constant_memory": True}) as workbook:
+        header = workbook.add_format({"bold": True, "border": 1, "align": "center"})
+        date = workbook.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"})
+        for name, df in sheets.items():
+            worksheet = workbook.add_worksheet(name)
+            worksheet.write_row(0, 0, df.columns, header)
+
+            columns = [get_cell_values(df[col]) for col in df.columns]
+            dates = [
+                i
+                for i, col in enumerate(df.columns)
+                if pd.api.types.is_datetime64_any_dtype(df[col])
+            ]
+            for row, values in enumerate(zip(*columns), start=1):
+                worksheet.write_row(row, 0, values)
+                for i in dates:
+                    if values[i] != None:
+                        worksheet.write_datetime(row, i, values[i], date)
+
+
+def export_excel_openpyxl(sheets, fp):
+    with pd.ExcelWriter(fp, engine="openpyxl") as writer:
+        for name, df in sheets.items():
+            df.to_excel(writer, sheet_name=name, index=False)
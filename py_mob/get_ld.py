@@ -1,31 +1,46 @@
 import os
 import pandas as pd
-from pathlib import Path
+from fnmatch import fnmatch
 
 
-def get_ld(dir_path, **kwargs):
-    df = pd.DataFrame(columns=["fp", "fn", "f", "ext", "fp_abs"])
-    file_path = []
-    for root, dir, files in os.walk(dir_path):
-        for file in files:
-            file_path.append(os.path.join(root, file))
+def iter_ld(dir_path, **kwargs):
+    # yields os.DirEntry objects - stat() is only called when it is needed
+    ext = kwargs.get("ext", None)
+    pattern = kwargs.get("pattern", None)
+    if isinstance(pattern, str):
+        pattern = [pattern]
 
-    fn = []
-    f = []
-    ext = []
-    fp_abs = []
+    dirs = []
+    try:
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        dirs.append(entry.path)
+                    continue
+                if ext != None and not entry.path.endswith(ext):
+                    continue
+                if pattern != None and not any(fnmatch(entry.name, p) for p in pattern):
+                    continue
+                yield entry
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return
 
-    for fp in file_path:
-        fn.append(Path(fp).name)
-        f.append(Path(fp).stem)
-        ext.append(Path(fp).suffix)
-        fp_abs.append(Path(fp).absolute())
+    # files of a folder come before its subfolders, as with os.walk
+    if kwargs.get("recursive", True) == True:
+        for path in dirs:
+            yield from iter_ld(path, **kwargs)
 
-    data = {"fp": file_path, "fn": fn, "f": f, "ext": ext, "fp_abs": fp_abs}
-    df = pd.concat([df, pd.DataFrame(data)], axis=0)
-    df = df.astype(str)
 
-    if kwargs.get("ext", None) != None:
-        df = df.loc[df["fp"].str.endswith(kwargs.get("ext", None))]
+def get_ld(dir_path, **kwargs):
+    data = {"fp": [], "fn": [], "f": [], "ext": [], "fp_abs": []}
+    for entry in iter_ld(dir_path, **kwargs):
+        f, ext = os.path.splitext(entry.name)
+        data["fp"].append(entry.path)
+        data["fn"].append(entry.name)
+        data["f"].append(f)
+        data["ext"].append(ext)
+        data["fp_abs"].append(os.path.abspath(entry.path))
 
-    return df.reset_index(drop=True)
+    df = pd.DataFrame(data, dtype=str)
+    return df
@@ -1,12 +1,25 @@
+import os
+import hashlib
 import numpy as np
 import pandas as pd
 import geopandas as gpd
 import struct
+from functools import lru_cache
+from pyproj import CRS, Transformer
+from concurrent.futures import ThreadPoolExecutor
+import scipy.linalg
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist
+from scipy.interpolate import LinearNDInterpolator
 from pykrige.ok import OrdinaryKriging
+from pykrige.variogram_models import exponential_variogram_model
+import shapely
 from shapely import Point, MultiPoint
 
+from .cache import file_lock, variogram_fp, load_variogram, save_variogram
 
-def kriging(meas):
+
+def kriging(meas, **kwargs):
     data = meas.data.copy()
     data = data.dropna(subset="voltage_norm")
     data = data.query("attribute == 'meas'")
@@ -15,46 +28,334 @@ def kriging(meas):
     y = data["y"].values
     z = data["voltage_norm"].values
 
-    x0 = min(x) - 5
-    y0 = min(y) - 5
-    x100 = max(x) + 5
-    y100 = max(y) + 5
+    polygon = meas.extents["geometry"].iloc[0]
+    grid_x, grid_y = get_grid_axes(x, y, polygon, **kwargs)
+
+    method = kwargs.get("method", "kriging")
+    if method != "kriging":
+
+        def krige(gx, gy):
+            return interpolate(x, y, z, gx, gy, **kwargs)
+
+    elif kwargs.get("local", False) == True:
+        params = get_variogram(x, y, z, kwargs.get("fit_points", 2000), **kwargs)
+
+        def krige(gx, gy):
+            return krige_local(x, y, z, gx, gy, params, **kwargs)
+
+    elif kwargs.get("tile", None) != None:
+        # tiles share one factorized kriging matrix instead of refitting per call
+        params = get_variogram(x, y, z, len(x), **kwargs)
+        a_inv = ok_factor(x, y, params)
+
+        def krige(gx, gy):
+            gx, gy = np.meshgrid(gx, gy)
+            zt = ok_predict(a_inv, x, y, z, gx.ravel(), gy.ravel(), params)
+            return zt.reshape(gx.shape)
+
+    else:
+        # without a cache pykrige fits the variogram itself
+        params = None
+        if kwargs.get("variogram", None) != None:
+            psill, range_, nugget = get_variogram(x, y, z, len(x), **kwargs)
+            params = {"psill": psill, "range": range_, "nugget": nugget}
+
+        def krige(gx, gy):
+            ok = OrdinaryKriging(
+                x,
+                y,
+                z,
+                variogram_model="exponential",
+                variogram_parameters=params,
+                exact_values=True,
+            )
+            return ok.execute("grid", gx, gy)[0].data
+
+    if kwargs.get("tile", None) != None:
+        mask = get_grid_mask(grid_x, grid_y, polygon)
+        grid_z = krige_tiled(grid_x, grid_y, mask, krige, **kwargs)
+    else:
+        grid_z = krige(grid_x, grid_y)
+    grid_z = np.round(grid_z, 3)
+    mesh = np.meshgrid(grid_x, grid_y)
 
-    cell_size = 0.25
-    cells_x = int((x100 - x0) / cell_size)
-    cells_y = int((y100 - y0) / cell_size)
+    # mesh[2] = grid_z.data
+    return mesh[0], mesh[1], grid_z
 
-    grid_x = np.linspace(x0, x100, cells_x)
-    grid_y = np.linspace(y0, y100, cells_y)
 
-    ok = OrdinaryKriging(x, y, z, variogram_model="exponential", exact_values=True)
+def get_grid_axes(x, y, polygon, **kwargs):
+    cell_size = kwargs.get("cell_size", 0.25)
+    max_nodes = kwargs.get("max_nodes", 2_000_000)
 
-    grid_z, ss = ok.execute("grid", grid_x, grid_y)
-    grid_z = np.round(grid_z, 3)
-    mesh = np.meshgrid(grid_x, grid_y)
+    # lattice covers only the bounding box of the extents hull
+    x0, y0, x100, y100 = polygon.bounds
 
-    # mesh[2] = grid_z.data
-    return mesh[0], mesh[1], grid_z.data
+    if cell_size == "auto":
+        # half of the median distance between neighbouring measurements
+        xy = np.column_stack([x, y])
+        dist = cKDTree(xy).query(xy, k=2)[0][:, -1]
+        dist = dist[dist > 0]
+        if len(dist) > 0:
+            cell_size = np.median(dist) / 2
+            cell_size = max(cell_size, kwargs.get("min_cell_size", 0.1))
+        else:
+            cell_size = 0.25
 
+    # node budget - coarsen the cells until the lattice fits
+    area = (x100 - x0) * (y100 - y0)
+    cell_size = max(cell_size, np.sqrt(area / max_nodes))
 
-def mask_grid(meas):
+    cells_x = max(int((x100 - x0) / cell_size), 2)
+    cells_y = max(int((y100 - y0) / cell_size), 2)
 
-    grid_x = meas.grid_x
-    grid_y = meas.grid_y
+    grid_x = np.linspace(x0, x100, cells_x)
+    grid_y = np.linspace(y0, y100, cells_y)
+    return grid_x, grid_y
+
+
+def krige_tiled(grid_x, grid_y, mask, krige, **kwargs):
+    tile = kwargs.get("tile", 256)
+    workers = kwargs.get("workers", os.cpu_count())
+
+    # tiles without any node inside the extents are left empty
+    tiles = []
+    for i in range(0, len(grid_y), tile):
+        for j in range(0, len(grid_x), tile):
+            if mask[i : i + tile, j : j + tile].any():
+                tiles.append((i, j))
+
+    def run(ij):
+        i, j = ij
+        return i, j, krige(grid_x[j : j + tile], grid_y[i : i + tile])
+
+    grid_z = np.full((len(grid_y), len(grid_x)), np.nan)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i, j, zt in pool.map(run, tiles):
+            grid_z[i : i + tile, j : j + tile] = zt
+    return grid_z
+
+
+def interpolate(x, y, z, grid_x, grid_y, chunk=65536, **kwargs):
+    method = kwargs.get("method", "idw")
+    gx, gy = np.meshgrid(grid_x, grid_y)
+    nodes = np.column_stack([gx.ravel(), gy.ravel()])
+    xy = np.column_stack([x, y])
+
+    if method == "linear":
+        grid_z = LinearNDInterpolator(xy, z)(nodes)
+        return grid_z.reshape(gx.shape)
+
+    if method == "nearest":
+        k = 1
+    elif method == "idw":
+        k = min(kwargs.get("neighbours", 12), len(x))
+        power = kwargs.get("power", 2)
+    else:
+        raise ValueError(f"Unknown interpolation method: {method}")
+
+    tree = cKDTree(xy)
+    grid_z = np.empty(len(nodes))
+    for i in range(0, len(nodes), chunk):
+        dist, idx = tree.query(nodes[i : i + chunk], k=k)
+        dist, idx = dist.reshape(len(dist), k), idx.reshape(len(idx), k)
+        if method == "nearest":
+            grid_z[i : i + chunk] = z[idx[:, 0]]
+            continue
+        # nodes on top of a measurement point take its value
+        with np.errstate(divide="ignore"):
+            w = 1 / dist**power
+        hit = np.isinf(w)
+        w[hit.any(axis=1)] = hit[hit.any(axis=1)]
+        grid_z[i : i + chunk] = np.sum(w * z[idx], axis=1) / np.sum(w, axis=1)
+    return grid_z.reshape(gx.shape)
+
+
+def get_variogram(x, y, z, max_points, **kwargs):
+    # variogram="points" reuses the fit for identical points (a reprocessed or
+    # recoloured file), variogram="run" fits once and shares it within the run
+    variogram = kwargs.get("variogram", None)
+    if variogram == "points":
+        points = hashlib.sha1(np.column_stack([x, y, z]).tobytes()).hexdigest()
+        key = f"points_{points}"
+    elif variogram == "run":
+        key = "run"
+    else:
+        key = None
+
+    if key == None:
+        return fit_variogram(x, y, z, max_points)
+
+    # parallel workers wait for the first fit instead of fitting again
+    with file_lock(variogram_fp(key)):
+        params = load_variogram(key)
+        if params == None:
+            params = fit_variogram(x, y, z, max_points)
+            save_variogram(key, params)
+    return params
+
+
+def fit_variogram(x, y, z, max_points):
+    # the automatic fit needs all pairwise distances - use a fixed subsample
+    if len(x) > max_points:
+        idx = np.random.default_rng(0).choice(len(x), max_points, replace=False)
+        x, y, z = x[idx], y[idx], z[idx]
+    ok = OrdinaryKriging(x, y, z, variogram_model="exponential")
+    return list(ok.variogram_model_parameters)
+
+
+def krige_local(x, y, z, grid_x, grid_y, params, **kwargs):
+    k = min(kwargs.get("neighbours", 32), len(x))
+    radius = kwargs.get("radius", None)
+    block = kwargs.get("block", 16)
+
+    tree = cKDTree(np.column_stack([x, y]))
+    grid_z = np.full((len(grid_y), len(grid_x)), np.nan)
+
+    # one kriging system per block of nodes, built from the block's neighbours
+    for i in range(0, len(grid_y), block):
+        by = grid_y[i : i + block]
+        for j in range(0, len(grid_x), block):
+            bx = grid_x[j : j + block]
+            center = [(bx[0] + bx[-1]) / 2, (by[0] + by[-1]) / 2]
+            if radius == None:
+                dist, idx = tree.query(center, k=k)
+                idx = np.atleast_1d(idx)
+            else:
+                r = radius + np.hypot(bx[-1] - bx[0], by[-1] - by[0]) / 2
+                dist, idx = tree.query(center, k=k, distance_upper_bound=r)
+                idx = np.atleast_1d(idx)[np.isfinite(np.atleast_1d(dist))]
+            if len(idx) == 0:
+                continue
+            gx, gy = np.meshgrid(bx, by)
+            zb = solve_ok(x[idx], y[idx], z[idx], gx.ravel(), gy.ravel(), params)
+            grid_z[i : i + block, j : j + block] = zb.reshape(gx.shape)
+    return grid_z
+
+
+def ok_factor(x, y, params):
+    n = len(x)
+    xy = np.column_stack([x, y])
+
+    a = np.zeros((n + 1, n + 1))
+    a[:n, :n] = -exponential_variogram_model(params, cdist(xy, xy))
+    np.fill_diagonal(a, 0.0)
+    a[n, :] = 1.0
+    a[:, n] = 1.0
+    a[n, n] = 0.0
+
+    # explicit inverse like pykrige - tiles then only need a matrix product
+    try:
+        return scipy.linalg.inv(a)
+    except np.linalg.LinAlgError:
+        # duplicate points make the system singular
+        return np.linalg.pinv(a)
+
+
+def ok_predict(a_inv, x, y, z, xp, yp, params, eps=1e-10, chunk=1024):
+    n = len(x)
+    xy = np.column_stack([x, y])
+    zp = np.empty(len(xp))
+
+    # z @ (a_inv @ b)[:n] == (z @ a_inv[:n]) @ b - one dot product per node
+    c = z @ a_inv[:n]
+
+    # node chunks keep the (points x nodes) distance matrix small
+    for i in range(0, len(xp), chunk):
+        bd = cdist(xy, np.column_stack([xp[i : i + chunk], yp[i : i + chunk]]))
+        b = -exponential_variogram_model(params, bd)
+        b[bd <= eps] = 0.0
+        zp[i : i + chunk] = c[:n] @ b + c[n]
+    return zp
+
+
+def solve_ok(x, y, z, xp, yp, params):
+    return ok_predict(ok_factor(x, y, params), x, y, z, xp, yp, params)
+
+
+def mask_grid(meas, **kwargs):
     grid_z = meas.grid_z_full
+    polygon = meas.extents["geometry"].iloc[0]
 
-    polygon = meas.extents
-    z_flat = grid_z.flatten()
+    if kwargs.get("mask", "raster") == "raster":
+        mask = get_grid_mask(meas.grid_x[0], meas.grid_y[:, 0], polygon)
+    else:
+        points = gpd.GeoSeries(
+            gpd.points_from_xy(meas.grid_x.flatten(), meas.grid_y.flatten())
+        )
+        mask = polygon.contains(points).values.reshape(grid_z.shape)
 
-    points = gpd.GeoSeries(gpd.points_from_xy(grid_x.flatten(), grid_y.flatten()))
-    polygon = meas.extents["geometry"].iloc[0]
-    mask = polygon.contains(points)
-    mask = np.where(mask == False)
-    z_flat[mask] = np.nan
-    grid_z_masked = z_flat.reshape(grid_z.shape)
+    grid_z_masked = np.where(mask, grid_z, np.nan)
     return grid_z_masked
 
 
+def get_grid_mask(x, y, polygon, chunk=256):
+    # even-odd scanline fill of the polygon rings on the regular lattice
+    rings = shapely.get_rings(shapely.get_parts(polygon))
+    x0, y0, x1, y1 = [], [], [], []
+    for ring in rings:
+        coords = shapely.get_coordinates(ring)
+        x0.append(coords[:-1, 0])
+        y0.append(coords[:-1, 1])
+        x1.append(coords[1:, 0])
+        y1.append(coords[1:, 1])
+    x0, y0, x1, y1 = [np.concatenate(c) for c in [x0, y0, x1, y1]]
+
+    mask = np.zeros((len(y), len(x)), dtype=bool)
+    for i in range(0, len(y), chunk):
+        yy = y[i : i + chunk, np.newaxis]
+        row, edge = np.nonzero((y0 <= yy) != (y1 <= yy))
+        t = (yy[row, 0] - y0[edge]) / (y1[edge] - y0[edge])
+        x_cross = x0[edge] + t * (x1[edge] - x0[edge])
+
+        # node is inside if an odd number of edges cross the row left of it
+        col = np.searchsorted(x, x_cross, side="right")
+        crossings = np.zeros((len(yy), len(x) + 1), dtype=np.uint8)
+        np.add.at(crossings, (row, col), 1)
+        mask[i : i + chunk] = (
+            np.cumsum(crossings, axis=1, dtype=np.uint8)[:, :-1] % 2 == 1
+        )
+    return mask
+
+
+# projections where easting only depends on longitude and northing on latitude
+SEPARABLE = [
+    "Popular Visualisation Pseudo Mercator",
+    "Mercator (variant A)",
+    "Mercator (variant B)",
+]
+
+
+@lru_cache(maxsize=None)
+def get_transformer(crs_from, crs_to):
+    return Transformer.from_crs(crs_from, crs_to, always_xy=True)
+
+
+@lru_cache(maxsize=None)
+def is_separable(crs_from, crs_to):
+    crs_from = CRS(crs_from)
+    crs_to = CRS(crs_to)
+    if crs_from.coordinate_operation == None or not crs_to.is_geographic:
+        return False
+    if crs_from.coordinate_operation.method_name not in SEPARABLE:
+        return False
+    return crs_from.geodetic_crs == crs_to.geodetic_crs
+
+
+def transform_grid(grid_x, grid_y, crs_from, crs_to=4326):
+    transformer = get_transformer(crs_from, crs_to)
+    if is_separable(crs_from, crs_to):
+        # regular grid stays regular - only the axes are reprojected
+        x = grid_x[0]
+        y = grid_y[:, 0]
+        lon = transformer.transform(x, np.full_like(x, y[0]))[0]
+        lat = transformer.transform(np.full_like(y, x[0]), y)[1]
+        grid_x = np.broadcast_to(lon, grid_x.shape)
+        grid_y = np.broadcast_to(lat[:, np.newaxis], grid_y.shape)
+    else:
+        grid_x, grid_y = transformer.transform(grid_x, grid_y)
+    return grid_x, grid_y
+
+
 # def mask_grid(df, grid, x, y):
 #     df = df[[x, y, "dV_norm"]]
 #     df = df.dropna().reset_index(drop=True)
@@ -80,63 +381,111 @@ def mask_grid(meas):
 #     return grid_z_masked
 
 
-def export_surfer_grid(data_array, x_coords, y_coords, output_file):
+SURFER_NODATA = 1.70141e38
+SURFER_HEADER = "<4shh6d"
+
+
+def export_surfer_grid(data_array, x_coords, y_coords, output_file, chunk=1024):
     """
     Saves a NumPy 2D array to a Surfer 6 Binary Grid file.
 
+    The header is written first and the values are then copied into a
+    memory-mapped view of the file in row chunks, without temporary
+    copies of the whole grid.
+
     Args:
         data_array (np.ndarray): The 2D NumPy array of grid values.
                                  The shape should be (ny, nx).
         x_coords (np.ndarray): 1D array of the X-coordinates for the columns.
         y_coords (np.ndarray): 1D array of the Y-coordinates for the rows.
         output_file (str): Path to the output .grd file.
+        chunk (int): Number of rows copied at once.
     """
-    # Surfer's NoData value
-    no_data_value = 1.70141e38
-
-    # Get grid dimensions from the array shape
     ny, nx = data_array.shape
 
-    # Get spatial extents from coordinate arrays
-    xlo, xhi = x_coords.min(), x_coords.max()
-    ylo, yhi = y_coords.min(), y_coords.max()
+    xlo, xhi = np.min(x_coords), np.max(x_coords)
+    ylo, yhi = np.min(y_coords), np.max(y_coords)
+    zlo, zhi = np.nanmin(data_array), np.nanmax(data_array)
 
-    # Handle NaN values and find Z extents
-    # Replace any np.nan with Surfer's NoData value
-    grid_data = np.nan_to_num(data_array, nan=no_data_value)
-
-    # Find min/max Z values, ignoring the NoData value
-    zlo = grid_data[grid_data != no_data_value].min()
-    zhi = grid_data[grid_data != no_data_value].max()
-
-    # Open the file for binary writing
+    # '<' little-endian, '4s' identifier, 'h' short (nx, ny), 'd' double extents
+    header = struct.pack(SURFER_HEADER, b"DSBB", nx, ny, xlo, xhi, ylo, yhi, zlo, zhi)
     with open(output_file, "wb") as f:
-        # --- Write the Header ---
-        # Pack the header values into a binary string.
-        # '<' denotes little-endian byte order.
-        # '4s' = 4-char string
-        # 'h' = short integer (2 bytes)
-        # 'd' = double (8 bytes)
-        header_format = "<4shh6d"
-        header = struct.pack(
-            header_format,
-            b"DSBB",  # Binary file identifier
-            nx,
-            ny,
-            xlo,
-            xhi,
-            ylo,
-            yhi,
-            zlo,
-            zhi,
-        )
         f.write(header)
+        f.truncate(len(header) + ny * nx * 4)
+
+    # Surfer grids are written from bottom-left, row by row - the grid rows
+    # are ordered by ascending y already, so no flip is needed
+    grid = np.memmap(
+        output_file, dtype="<f4", mode="r+", offset=len(header), shape=(ny, nx)
+    )
+    for i in range(0, ny, chunk):
+        rows = grid[i : i + chunk]
+        rows[:] = data_array[i : i + chunk]
+        rows[np.isnan(rows)] = SURFER_NODATA
+    grid.flush()
+    del grid
+
+
+def read_surfer_grid(input_file):
+    """
+    Opens a Surfer 6 Binary Grid file as a read-only memory map.
 
-        # --- Write the Data ---
-        # Ensure data is in 4-byte float format and flatten it.
-        # Surfer grids are written from bottom-left, row by row.
-        # NumPy arrays are indexed from top-left, so we don't need to flip.
-        flat_data = grid_data.astype(np.float32).flatten()
+    Args:
+        input_file (str): Path to the .grd file.
 
-        # Write the flattened array to the file
-        f.write(flat_data.tobytes())
+    Returns:
+        tuple: (data_array, x_coords, y_coords, header). The data array is a
+            np.memmap of shape (ny, nx); blank nodes keep SURFER_NODATA.
+    """
+    size = struct.calcsize(SURFER_HEADER)
+    with open(input_file, "rb") as f:
+        values = struct.unpack(SURFER_HEADER, f.read(size))
+    if values[0] != b"DSBB":
+        raise ValueError(f"{input_file} is not a Surfer 6 binary grid")
+
+    keys = ["nx", "ny", "xlo", "xhi", "ylo", "yhi", "zlo", "zhi"]
+    header = dict(zip(keys, values[1:]))
+    ny, nx = header["ny"], header["nx"]
+    data_array = np.memmap(
+        input_file, dtype="<f4", mode="r", offset=size, shape=(ny, nx)
+    )
+    x_coords = np.linspace(header["xlo"], header["xhi"], nx)
+    y_coords = np.linspace(header["ylo"], header["yhi"], ny)
+    return data_array, x_coords, y_coords, header
+
+
+def export_geotiff(data_array, x_coords, y_coords, output_file, crs, **kwargs):
+    # rasterio is optional - only needed for GeoTIFF output
+    try:
+        import rasterio
+        from rasterio.transform import from_origin
+    except ImportError:
+        raise ImportError(
+            "GeoTIFF export requires rasterio (pip install -r req_optional.txt)"
+        )
+
+    ny, nx = data_array.shape
+    dx = (x_coords[-1] - x_coords[0]) / max(nx - 1, 1)
+    dy = (y_coords[-1] - y_coords[0]) / max(ny - 1, 1)
+
+    # grid nodes are pixel centres, raster rows run north to south
+    transform = from_origin(x_coords[0] - dx / 2, y_coords[-1] + dy / 2, dx, dy)
+    nodata = kwargs.get("nodata", -9999.0)
+    data = np.where(np.isnan(data_array[::-1]), nodata, data_array[::-1])
+
+    profile = {
+        "driver": "COG",
+        "width": nx,
+        "height": ny,
+        "count": 1,
+        "dtype": "float32",
+        "crs": rasterio.crs.CRS.from_user_input(crs),
+        "transform": transform,
+        "nodata": nodata,
+        "blocksize": kwargs.get("blocksize", 256),
+        "compress": kwargs.get("compress", "deflate"),
+        "predictor": "yes",
+        "overview_resampling": kwargs.get("overview_resampling", "average"),
+    }
+    with rasterio.open(output_file, "w", **profile) as dst:
+        dst.write(data.astype(np.float32), 1)
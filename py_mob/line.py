@@ -13,17 +13,16 @@ def get_lines(df):
     mask = np.max(df[["dst_fwd", "dst_bck"]], axis=1) > 4
     df.loc[mask, "split"] = 1
 
-    for i in range(1, len(df)):
-        if df["split"][i] == df["split"][i - 1]:
-            df.loc[i, "split"] = 0
-
-    l = 0
-    line = []
-    for s in df["split"]:
-        line.append(l)
-        if s == 1:
-            l += 1
-    df["line"] = line
+    # consecutive splits alternate 1, 0, 1, ... - keep only even positions of each run
+    split = df["split"].to_numpy()
+    pos = np.arange(len(split))
+    start = np.diff(split, prepend=0) == 1
+    run_start = np.maximum.accumulate(np.where(start, pos, 0))
+    split = np.where((split == 1) & ((pos - run_start) % 2 == 0), 1, 0)
+    df["split"] = split
+
+    # line counter is incremented after each split point
+    df["line"] = np.cumsum(split) - split
 
     return df
 
@@ -125,21 +124,16 @@ def get_pt_hdg(df):
 
 def calc_line_pos(df):
     df = df.dropna(subset="ID_line")
-    index = df["ID"]
-    line_pos = np.array([])
-    line_pts = np.array([])
+    index = df.index
 
-    for line in df["ID_line"].unique():
-        df_line = df.loc[df["ID_line"] == line]
-        n = len(df_line)
-        tmp = np.arange(0, n, 1)
-        tmp = tmp / np.max(tmp)
-        line_pos = np.append(line_pos, tmp)
+    gb = df.groupby("ID_line", sort=False)["ID_line"]
+    line_pts = gb.transform("size").to_numpy(dtype=float)
+    pos = gb.cumcount().to_numpy(dtype=float)
 
-        tmp = np.tile(n, n)
-        line_pts = np.append(line_pts, tmp)
+    # single point lines get position 0
+    line_pos = np.zeros(len(df))
+    np.divide(pos, line_pts - 1, out=line_pos, where=line_pts > 1)
 
-    line_pos[np.isnan(line_pos) == True] = 0
     line_pts_norm = line_pts / np.quantile(line_pts, 0.25)
     line_pts_norm = np.clip(line_pts_norm, 0, 1)
 
@@ -1,23 +1,39 @@
 import pandas as pd
-import numpy as np
-from .get_ld import get_ld
+from .cache import file_lock, write_atomic
 
+SENSORS = "py_mob/sensors.tsv"
+
+# serial number -> logger number, loaded once per process
+registry = {}
+
+
+def load_sensors(fp=SENSORS):
+    df = pd.read_csv(fp, sep="\t", dtype={"orig": str, "new": int})
+    return dict(zip(df["orig"], df["new"]))
 
-def logger_load_from_db(sensor_id):
-    df = pd.read_csv("py_mob/sensors.tsv", sep="\t")
 
-    if sensor_id not in df["orig"].values:
-        df_new = pd.DataFrame({"orig": [sensor_id], "new": [np.nan]})
+def save_sensors(sensors, fp=SENSORS):
+    df = pd.DataFrame({"orig": list(sensors.keys()), "new": list(sensors.values())})
+    write_atomic(fp, df.to_csv(sep="\t", index=False, lineterminator="\n"))
 
-        df = pd.concat([df, df_new]).drop_duplicates(subset="orig", keep="first")
 
-        df["new"] = df["new"].interpolate(
-            "slinear", fill_value="extrapolate", limit_direction="both"
-        )
-        df["new"] = df["new"].astype("Int64")
-        df["new"] = df["new"].astype(str)
-        df.to_csv("sensors.csv", index=False)
+def register_sensor(sensor_id, fp=SENSORS):
+    # re-read under the lock - another worker may have registered it meanwhile
+    with file_lock(fp):
+        sensors = load_sensors(fp)
+        if sensor_id not in sensors:
+            sensors[sensor_id] = max(sensors.values(), default=0) + 1
+            save_sensors(sensors, fp)
+    registry.clear()
+    registry.update(sensors)
+    return registry
+
+
+def logger_load_from_db(sensor_id):
+    if len(registry) == 0:
+        registry.update(load_sensors())
+    if sensor_id not in registry:
+        register_sensor(sensor_id)
 
-    sensor_id = df.loc[df["orig"] == sensor_id, "new"].iloc[0]
-    sensor_id = str(sensor_id).zfill(3)
+    sensor_id = str(registry[sensor_id]).zfill(3)
     return sensor_id
@@ -2,10 +2,8 @@ import pandas as pd
 import geopandas as gpd
 import os
 from pathlib import Path
-from io import StringIO
 import numpy as np
 from shapely import Point, MultiPoint, LineString, get_coordinates
-from plotly.colors import sample_colorscale
 
 
 from .angles import angle_full, angle_360, angle_points, angle_signed, angle_dx_dy
@@ -13,16 +11,39 @@ from .proc import calc_compass
 
 from .line import get_line_data, get_pt_hdg, split_lines, get_lines, calc_line_pos
 
-from .colors import rgb_to_hex, get_default_crange
+from .colors import map_colors, get_default_crange
 from .logger import logger_load_from_db
-from .gridding import kriging, mask_grid, export_surfer_grid
-from .plot import fig_traces, fig_format
+from .gridding import (
+    kriging,
+    mask_grid,
+    export_surfer_grid,
+    export_geotiff,
+    transform_grid,
+)
+from .excel import (
+    get_excel_cols,
+    get_sheets,
+    export_excel_xlsxwriter,
+    export_excel_openpyxl,
+)
+from .profiling import profile_stage
+from .cache import file_hashes, load_state, load_state_grid, save_state
+from .plot import fig_traces, fig_format, get_plotlyjs
 
 
 class Meas:
     def __init__(self, fp, **kwargs):
         self.fp_csv = fp
         self.crs = kwargs.get("crs", 3857)
+        self.output = kwargs.get("output", "output")
+        self.csv_engine = kwargs.get("csv_engine", "c")
+        self.grid_kw = kwargs.get("grid", {})
+        self.html_kw = kwargs.get("html", {})
+        self.excel_kw = kwargs.get("excel", {})
+        self.profile = kwargs.get("profile", False)
+        self.stats = []
+        self.state_key = None
+        self.grid_state = None
         print(self.fp_csv[4:])
 
     def __call__(self, **kwargs):
@@ -46,117 +67,175 @@ class Meas:
         return self
 
     def Proc(self):
-        self.Read_csv()
-        self.Get_fps()
+        stages = [
+            self.Read_csv,
+            self.Get_fps,
+            self.Calc_compass,
+            self.Get_meas_extents,
+            self.Get_current,
+            self.Get_meas_path,
+            self.Get_ref_pt,
+            self.Calc_ref_bearing,
+            self.Calc_hdg_avg,
+            self.Calc_ref_facing,
+            self.Calc_voltage_norm,
+            self.Get_crange,
+            self.Get_colors,
+            self.Get_line_pos,
+            self.Sort_columns,
+        ]
+        for stage in stages:
+            self.Run_stage(stage)
+        return self
 
-        self.data = calc_compass(self.data)
-        self.Get_meas_extents()
-        self.Get_current()
-        self.Get_meas_path()
-        self.Get_ref_pt()
-        self.Calc_ref_bearing()
-        self.Calc_hdg_avg()
-        self.Calc_ref_facing()
-        self.Calc_voltage_norm()
-        self.Get_crange()
-        self.Get_colors()
-        self.data = self.data.sort_index(axis=1)
-        # self.Get_line_pos()
+    def Proc_cached(self, key=None):
+        # data unchanged - only the colour range is read again from the header
+        if key == None:
+            key = file_hashes(self.fp_csv)[1]
+        if load_state(self, key):
+            # the state is shared by all files with the same data
+            self.extents["fp"] = self.fp_csv
+            with open(self.fp_csv, "r") as file:
+                self.get_header_data(file.readline())
+            self.Set_fps()
+            self.Recolor()
+            self.state_key = key
+        else:
+            self.Proc()
+        return self
+
+    def Save_state(self, key=None, hash=None):
+        if key == None:
+            hash, key = file_hashes(self.fp_csv)
+        save_state(self, key, hash)
+        return self
+
+    def Recolor(self, cmin=None, cmax=None):
+        if cmin != None and cmax != None:
+            self.cmin = cmin
+            self.cmax = cmax
+        for stage in [self.Get_crange, self.Get_colors]:
+            self.Run_stage(stage)
         return self
 
     def Export(self):
-        self.Export_excel()
-        self.Export_grid(wgs=True)
-        self.Export_html()
-        self.Export_bln()
+        # a cached state keeps its grid - only the coloured outputs are rewritten
+        if self.state_key != None and load_state_grid(self, self.state_key):
+            stages = [self.Export_excel, self.Export_html]
+        else:
+            stages = [
+                self.Export_excel,
+                self.Export_grid,
+                self.Export_html,
+                self.Export_bln,
+            ]
+        for stage in stages:
+            self.Run_stage(stage)
+        return self
+
+    def Run_stage(self, stage):
+        if self.profile == True:
+            with profile_stage(self.stats, stage.__name__):
+                stage()
+        else:
+            stage()
+        return self
+
+    def Calc_compass(self):
+        self.data = calc_compass(self.data)
+        return self
+
+    def Sort_columns(self):
+        self.data = self.data.sort_index(axis=1)
         return self
 
     def Get_fps(self):
         self.Get_logger_ids()
-        self.directory = f"output/{self.id_logger}/{self.id_datetime}"
+        self.Set_fps()
+        return self
+
+    def Set_fps(self):
+        self.directory = f"{self.output}/{self.id_logger}/{self.id_datetime}"
         self.filename = f"{self.id_logger}_{self.id_datetime}"
 
         if not os.path.exists(self.directory):
             os.makedirs(self.directory)
 
         self.fp = {}
-        for ext in ["html", "xlsx", "grd", "bln"]:
+        for ext in ["html", "xlsx", "csv", "parquet", "grd", "tif", "bln"]:
             self.fp[ext] = os.path.join(self.directory, self.filename + f".{ext}")
         return self
 
     def Read_csv(self):
-        self.get_header_data()
+        # counters are integers, the free-form logger fields (status, fix, fw) stay text
+        cols = {
+            "lon": "float64",
+            "lat": "float64",
+            "voltage_raw": "float64",
+            "ID_point": "Int64",
+            "attribute": str,
+            "attribute_counter": "Int64",
+            "date": str,
+            "time": str,
+            "compass_x": "float64",
+            "compass_y": "float64",
+            "compass_z": "float64",
+            "lat_int": "Int64",
+            "lon_int": "Int64",
+            "hdop": "float64",
+            "gnss_status": str,
+            "gnss_fix": str,
+            "fw": str,
+            "ser_num": str,
+        }
+        kwargs = dict(
+            header=None,
+            names=list(cols.keys()),
+            dtype=cols,
+            na_values=["nan", "nan ", " nan"],
+        )
+
+        # the first line is only sniffed, the parser continues on the same handle
         with open(self.fp_csv, "r") as file:
-            txt = file.read()
-
-        txt = txt.replace(":", ",")
-
-        df = pd.read_csv(StringIO(txt), skiprows=self.skiprows)
-        new_cols = [
-            "lon",
-            "lat",
-            "voltage_raw",
-            "ID_point",
-            "attribute",
-            "attribute_counter",
-            "date",
-            "time_hour",
-            "time_minute",
-            "time_sec",
-            "compass_x",
-            "compass_y",
-            "compass_z",
-            "lat_int",
-            "lon_int",
-            "hdop",
-            "gnss_status",
-            "gnss_fix",
-            "fw",
-            "ser_num",
-        ]
+            self.get_header_data(file.readline())
+            if self.csv_engine == "pyarrow":
+                skiprows = self.skiprows + 1
+                df = pd.read_csv(
+                    self.fp_csv, skiprows=skiprows, engine="pyarrow", **kwargs
+                )
+            else:
+                df = pd.read_csv(file, skiprows=self.skiprows, **kwargs)
 
-        df = df.rename(columns=dict(zip(df.columns, new_cols)))
-        df["attribute"] = list(map(lambda x: x.strip(), df["attribute"]))
+        df["attribute"] = df["attribute"].fillna("").str.strip()
         df["attribute"] = df["attribute"].replace("", "meas")
 
-        df["time"] = (
-            df["time_hour"].astype(str).str.zfill(2)
-            + ":"
-            + df["time_minute"].astype(str).str.zfill(2)
-            + ":"
-            + df["time_sec"].astype(str).str.zfill(2)
-        )
-        df["datetime"] = pd.to_datetime(df["date"] + "T" + df["time"])
+        df["datetime"] = pd.to_datetime(df["date"]) + pd.to_timedelta(df["time"])
+        df["time_hour"] = df["datetime"].dt.hour
+        df["time_minute"] = df["datetime"].dt.minute
+        df["time_sec"] = df["datetime"].dt.second
+        df["time"] = df["datetime"].dt.strftime("%H:%M:%S")
 
         geom = gpd.points_from_xy(df["lon"], df["lat"])
         gdf = gpd.GeoDataFrame(df, geometry=geom, crs=4326)
         gdf = gdf.to_crs(self.crs)
         gdf[["x", "y"]] = gdf.get_coordinates()
-        gdf = gdf.replace("nan ", np.nan)
-        gdf["voltage_raw"] = gdf["voltage_raw"].astype(float)
         self.data = gdf
         return self
 
-    def get_header_data(self):
+    def get_header_data(self, line):
         cmin = "def"
         cmax = "def"
 
-        with open(self.fp_csv) as file:
-            lines = file.readlines()
+        line = line.strip()
+        if len(line) == 0:
+            raise ValueError(f"{self.fp_csv} is empty!")
 
-        lines = [l.strip() for l in lines]
-
-        if len(lines) > 0:
-            if lines[0].startswith("long"):
-                self.skiprows = 0
-            else:
-                self.skiprows = 1
-                header = lines[0].split(",")
-                header = [h.strip() for h in header]
-                header = pd.Series(header)
-                cmin, cmax = header[[0, 1]].astype(float)
+        if line.startswith("long"):
+            self.skiprows = 0
         else:
-            self.skiprows = -1
+            self.skiprows = 1
+            header = [h.strip() for h in line.split(",")]
+            cmin, cmax = float(header[0]), float(header[1])
         self.cmin = cmin
         self.cmax = cmax
         return self
@@ -274,18 +353,13 @@ class Meas:
         colorscale = "RdBu_r"
         for voltage, type in zip(["voltage_raw", "voltage_norm"], ["r", "n"]):
 
-            values = self.data[voltage].clip(lower=self.cmin, upper=self.cmax)
-            values = values.fillna(0)
-            values = (values - self.cmin) / (self.cmax - self.cmin)
-
-            clr_rgb = sample_colorscale(colorscale=colorscale, samplepoints=values)
+            values = self.data[voltage].fillna(0).to_numpy()
+            clr_rgb, clr_hex = map_colors(values, self.cmin, self.cmax, colorscale)
 
             self.data[f"clr_{type}_rgb"] = clr_rgb
             mask = self.data[voltage].isnull()
             self.data.loc[mask, [f"clr_{type}_rgb"]] = "rgb(255, 0, 255)"
 
-            clr_hex = [rgb_to_hex(c) for c in clr_rgb]
-
             self.data[f"clr_{type}_hex"] = clr_hex
 
         return self
@@ -373,59 +447,69 @@ class Meas:
             self.data["d_angle"] = np.nan
         return self
 
-    def Export_excel(self):
-
-        cols = pd.read_csv("py_mob/cols_excel.tsv", sep="\t").iloc[:, 0]
-        cols = [col for col in cols if col in self.data.columns]
-        data = self.data.copy()[cols]
-        meas = data.loc[data["attribute"] == "meas"]
-        anomaly = data.loc[data["attribute"] == "anomaly"]
-        area = data.loc[data["attribute"] == "area"]
-        input = data.loc[data["attribute"].isin(["minus", "plus"])]
+    def Export_excel(self, **kwargs):
+        kwargs = {**self.excel_kw, **kwargs}
+        formats = kwargs.get("formats", ["xlsx"])
 
-        fp = self.fp["xlsx"]
+        cols = [col for col in get_excel_cols() if col in self.data.columns]
+        data = self.data[cols]
 
-        with pd.ExcelWriter(fp, engine="openpyxl") as writer:
-            meas.to_excel(writer, sheet_name="meas", index=False)
-            anomaly.to_excel(writer, sheet_name="anomaly", index=False)
-            area.to_excel(writer, sheet_name="area", index=False)
-            input.to_excel(writer, sheet_name="input", index=False)
+        if "xlsx" in formats:
+            sheets = get_sheets(data)
+            if kwargs.get("engine", "openpyxl") == "xlsxwriter":
+                export_excel_xlsxwriter(sheets, self.fp["xlsx"])
+            else:
+                export_excel_openpyxl(sheets, self.fp["xlsx"])
+        if "csv" in formats:
+            data.to_csv(self.fp["csv"], index=False)
+        if "parquet" in formats:
+            data.to_parquet(self.fp["parquet"], index=False)
 
     def Export_grid(self, **kwargs):
+        kwargs = {**self.grid_kw, **kwargs}
         if len(self.Filter_data("meas").dropna(subset="voltage_norm")) > 0:
-            self.grid_x, self.grid_y, self.grid_z_full = kriging(self)
-            self.grid_z = mask_grid(self)
+            self.grid_x, self.grid_y, self.grid_z_full = kriging(self, **kwargs)
+            self.grid_z = mask_grid(self, **kwargs)
+            formats = kwargs.get("formats", ["grd"])
+            empty = np.isnan(self.grid_z).all()
+            if empty:
+                print("Grid not exported - masked grid is empty!")
+            # GeoTIFF stays in the projected CRS
+            if "tif" in formats and not empty:
+                export_geotiff(
+                    self.grid_z,
+                    self.grid_x[0],
+                    self.grid_y[:, 0],
+                    self.fp["tif"],
+                    self.crs,
+                    **kwargs.get("tif", {}),
+                )
             if kwargs.get("wgs", True) == True:
                 self.Convert_grid_coordinates()
-            if pd.Series(self.grid_z.flatten()).dropna().count() > 0:
+            if "grd" in formats and not empty:
                 export_surfer_grid(
                     self.grid_z, self.grid_x, self.grid_y, self.fp["grd"]
                 )
-            else:
-                print("Grid not exported - masked grid is empty!")
             self.skip_grid = False
         else:
             self.skip_grid = True
 
         return self
 
-    def Export_html(self, width=1600, height=900):
-        fig = fig_traces(self)
+    def Export_html(self, width=1600, height=900, **kwargs):
+        kwargs = {**self.html_kw, **kwargs}
+        fig = fig_traces(self, **kwargs)
         fig = fig_format(fig, width, height)
-        fig.write_html(self.fp["html"])
+        if kwargs.get("mode", "full") == "light":
+            plotlyjs = get_plotlyjs(self.directory, self.output)
+        else:
+            plotlyjs = True
+        fig.write_html(self.fp["html"], include_plotlyjs=plotlyjs)
         self.fig = fig
         return self
 
     def Convert_grid_coordinates(self):
-        x = self.grid_x.flatten()
-        y = self.grid_y.flatten()
-
-        geom = gpd.points_from_xy(x, y)
-        gs = gpd.GeoSeries(geom).set_crs(self.crs)
-        gs = gs.to_crs(4326)
-        coords = gs.get_coordinates()
-        self.grid_x = np.reshape(coords["x"], self.grid_x.shape)
-        self.grid_y = np.reshape(coords["y"], self.grid_x.shape)
+        self.grid_x, self.grid_y = transform_grid(self.grid_x, self.grid_y, self.crs)
         return self
 
     def Filter_data(self, filter):
@@ -454,11 +538,12 @@ class Meas:
             file.writelines(lines)
 
     def Get_line_pos(self):
-        if len(self.Filter_data("meas")) > 0:
-            linepos = calc_line_pos(self.data)
-            data = {"line_pts": linepos[2], "line_pts_norm": linepos[3]}
-            df = pd.DataFrame(data=data, index=linepos[0])
-            self.data = pd.merge(
-                self.data, df, how="left", left_on="ID", right_index=True
-            )
+        for col in ["line_pos", "line_pts", "line_pts_norm"]:
+            self.data[col] = np.nan
+
+        if "ID_line" in self.data.columns and self.data["ID_line"].notna().any():
+            index, line_pos, line_pts, line_pts_norm = calc_line_pos(self.data)
+            self.data.loc[index, "line_pos"] = line_pos
+            self.data.loc[index, "line_pts"] = line_pts
+            self.data.loc[index, "line_pts_norm"] = line_pts_norm
         return self
@@ -1,21 +1,32 @@
+import os
+from pathlib import Path
 import pandas as pd
 import numpy as np
+import plotly
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from plotly.colors import sample_colorscale
 import plotly.io as pio
+from plotly.offline import get_plotlyjs as get_plotlyjs_src
 
 pio.templates.default = "plotly_dark"
 
 from .colors import get_k_clr
+from .cache import write_atomic
 
 
-def get_heatmap(meas):
+def get_heatmap(meas, max_cells=None):
     x0 = np.min(meas.grid_x)
     y0 = np.min(meas.grid_y)
 
     dx = np.ptp(meas.grid_x) / meas.grid_z.shape[1]
     dy = np.ptp(meas.grid_y) / meas.grid_z.shape[0]
+
+    # every n-th node is kept so the longer side fits the display resolution
+    step = 1
+    if max_cells != None:
+        step = max(int(np.ceil(max(meas.grid_z.shape) / max_cells)), 1)
+    grid_z = meas.grid_z[::step, ::step]
     zmin = meas.cmin
     zmax = meas.cmax
     colorbar = dict(
@@ -31,9 +42,9 @@ def get_heatmap(meas):
     plt = go.Heatmap(
         x0=x0,
         y0=y0,
-        dx=dx,
-        dy=dy,
-        z=meas.grid_z,
+        dx=dx * step,
+        dy=dy * step,
+        z=grid_z,
         name="grid",
         zmin=zmin,
         zmax=zmax,
@@ -44,7 +55,7 @@ def get_heatmap(meas):
     return plt
 
 
-def get_scatter_compass(meas):
+def get_scatter_compass(meas, scatter=go.Scatter):
     df = meas.Filter_data("meas")
     cd = df[
         [
@@ -68,7 +79,7 @@ def get_scatter_compass(meas):
     )
     line = dict(color="#000000", width=1)
     ht = "Point: %{customdata[0]}<br>Time:  %{customdata[1]}<br>Compass: %{customdata[2]}<br>V raw: %{customdata[3]}<br>V norm: %{customdata[4]}<br>V k: %{customdata[5]}<br>Line: %{customdata[6]}"
-    plt = go.Scatter(
+    plt = scatter(
         x=df["lon"],
         y=df["lat"],
         mode="lines+markers",
@@ -81,7 +92,7 @@ def get_scatter_compass(meas):
     return plt
 
 
-def get_scatter_values(meas, values):
+def get_scatter_values(meas, values, scatter=go.Scatter):
     if values == "norm":
         clr = "clr_n_hex"
     else:
@@ -107,7 +118,7 @@ def get_scatter_values(meas, values):
         line=dict(color="#000000", width=1),
     )
     ht = "Point: %{customdata[0]}<br>Time:  %{customdata[1]}<br>Compass: %{customdata[2]}<br>V raw: %{customdata[3]}<br>V norm: %{customdata[4]}<br>V k: %{customdata[5]}<br>Line: %{customdata[6]}"
-    plt = go.Scatter(
+    plt = scatter(
         x=df["lon"],
         y=df["lat"],
         mode="markers",
@@ -136,7 +147,7 @@ def get_pt_txt(meas):
     return plt
 
 
-def get_scatter_input(meas):
+def get_scatter_input(meas, scatter=go.Scatter):
 
     df = meas.Filter_data("input")
     cd = df[["ID_point", "datetime"]]
@@ -146,7 +157,7 @@ def get_scatter_input(meas):
 
     marker = dict(symbol=df["symbols"], size=8)
     ht = "Point: %{customdata[0]}<br>Time:  %{customdata[1]}"
-    plt = go.Scatter(
+    plt = scatter(
         x=df["lon"],
         y=df["lat"],
         mode="markers",
@@ -178,12 +189,12 @@ def get_histogram(meas):
     return plt
 
 
-def get_k_plot(meas):
+def get_k_plot(meas, scatter=go.Scatter):
     df = meas.Filter_data("meas")
     df = get_k_clr(df)
     marker = dict(color=df["clr"])
 
-    plt = go.Scatter(
+    plt = scatter(
         x=df["compass"],
         y=df["voltage_k"],
         mode="markers",
@@ -194,36 +205,43 @@ def get_k_plot(meas):
     return plt
 
 
-def fig_traces(meas):
+def fig_traces(meas, **kwargs):
+    # light mode - WebGL point traces and a heatmap at display resolution
+    if kwargs.get("mode", "full") == "light":
+        scatter = go.Scattergl
+        max_cells = kwargs.get("max_cells", 800)
+    else:
+        scatter = go.Scatter
+        max_cells = None
 
     fig = go.Figure(make_subplots(rows=2, cols=2))
 
     if meas.skip_grid == False:
-        plt_grid = get_heatmap(meas)
+        plt_grid = get_heatmap(meas, max_cells)
         fig.add_trace(plt_grid, row=1, col=2)
 
     if len(meas.Filter_data("meas")) > 0:
 
-        plt_k = get_k_plot(meas)
+        plt_k = get_k_plot(meas, scatter)
         fig.add_trace(plt_k, row=2, col=1)
 
         plt_hist = get_histogram(meas)
         fig.add_trace(plt_hist, row=1, col=1)
 
-        plt_compass = get_scatter_compass(meas)
+        plt_compass = get_scatter_compass(meas, scatter)
         fig.add_trace(plt_compass, row=1, col=2)
 
-        plt_values_norm = get_scatter_values(meas, "norm")
+        plt_values_norm = get_scatter_values(meas, "norm", scatter)
         fig.add_trace(plt_values_norm, row=1, col=2)
 
-        plt_values_raw = get_scatter_values(meas, "raw")
+        plt_values_raw = get_scatter_values(meas, "raw", scatter)
         fig.add_trace(plt_values_raw, row=1, col=2)
 
         plt_txt = get_pt_txt(meas)
         fig.add_trace(plt_txt, row=1, col=2)
 
     if len(meas.Filter_data("input")) > 0:
-        plt_input = get_scatter_input(meas)
+        plt_input = get_scatter_input(meas, scatter)
         fig.add_trace(plt_input, row=1, col=2)
 
     return fig
@@ -260,3 +278,12 @@ def fig_format(fig, width, height):
     # fig.update_layout(dragmode="pan")
 
     return fig
+
+
+def get_plotlyjs(directory, output="output"):
+    # plotly.js is written once per version to the output folder and shared by
+    # all reports - older reports keep the version they were written with
+    fp = os.path.join(output, f"plotly-{plotly.__version__}.min.js")
+    if not os.path.exists(fp):
+        write_atomic(fp, get_plotlyjs_src())
+    return Path(os.path.relpath(fp, directory)).as_posix()
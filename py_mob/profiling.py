@@ -0,0 +1,132 @@
+import os
+import sys
+import time
+import json
+import pandas as pd
+from contextlib import contextmanager
+
+
+def peak_rss():
+    # peak resident set size of this process in MB
+    if sys.platform == "win32":
+        return peak_rss_windows()
+    try:
+        # VmHWM follows reset_peak_rss, ru_maxrss does not
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            return rss / 1024**2
+        return rss / 1024
+    except ImportError:
+        return float("nan")
+
+
+def peak_rss_windows():
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    kernel32 = ctypes.WinDLL("kernel32")
+    psapi = ctypes.WinDLL("psapi")
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    psapi.GetProcessMemoryInfo.argtypes = [
+        wintypes.HANDLE,
+        ctypes.POINTER(PROCESS_MEMORY_COUNTERS),
+        wintypes.DWORD,
+    ]
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    process = kernel32.GetCurrentProcess()
+    if not psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+        return float("nan")
+    return counters.PeakWorkingSetSize / 1024**2
+
+
+def reset_peak_rss():
+    # only Linux can reset the high-water mark - elsewhere it stays the
+    # process lifetime peak and only peak_rss_delta is specific to a stage
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+# peaks of the stages still running - nested stages report into them
+open_peaks = []
+
+
+@contextmanager
+def profile_stage(stats, stage):
+    # a reset inside an outer stage would lose its peak, so it is kept here
+    rss = peak_rss()
+    open_peaks[:] = [max(peak, rss) for peak in open_peaks]
+    reset_peak_rss()
+    start = peak_rss()
+    open_peaks.append(start)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        peak = max(open_peaks.pop(), peak_rss())
+        open_peaks[:] = [max(p, peak) for p in open_peaks]
+        stats.append(
+            {
+                "stage": stage,
+                "wall": wall,
+                "cpu": cpu,
+                "peak_rss": peak,
+                "peak_rss_delta": peak - start,
+            }
+        )
+
+
+def save_profile(stats, directory="output/profile"):
+    df = pd.DataFrame(stats)
+    os.makedirs(directory, exist_ok=True)
+    fp = os.path.join(directory, time.strftime("%Y-%m-%d_%H-%M-%S"))
+    df.to_csv(f"{fp}.csv", index=False)
+    with open(f"{fp}.json", "w") as file:
+        json.dump(stats, file, indent=1, default=str)
+    return df
+
+
+def print_profile(df):
+    # stages ordered by the total wall time over all files
+    summary = df.groupby("stage", sort=False).agg(
+        n=("wall", "size"),
+        wall=("wall", "sum"),
+        wall_max=("wall", "max"),
+        cpu=("cpu", "sum"),
+        peak_rss=("peak_rss", "max"),
+        peak_rss_delta=("peak_rss_delta", "max"),
+    )
+    stages = summary.drop("run_total", errors="ignore")
+    summary["wall_pct"] = 100 * stages["wall"] / stages["wall"].sum()
+    summary = summary.sort_values("wall", ascending=False)
+    print(summary.round(3).to_string())
@@ -0,0 +1,73 @@
+import time
+import traceback
+
+from .get_ld import iter_ld
+from .batch import proc_files
+from .database import export_gdf
+from .cache import load_manifest, save_manifest, is_current, update_manifest
+
+
+def get_stable(dir_path, manifest, seen, **kwargs):
+    # a file is ready once size and mtime did not change over one poll interval
+    ready = []
+    for entry in iter_ld(dir_path, ext=".csv"):
+        stat = entry.stat()
+        signature = (stat.st_size, stat.st_mtime_ns)
+        previous = seen.get(entry.path, None)
+        seen[entry.path] = signature
+        if previous != signature or signature[0] == 0:
+            continue
+        if is_current(entry.path, manifest, **kwargs):
+            continue
+        ready.append(entry.path)
+    return ready
+
+
+def watch_folder(dir_path="raw", **kwargs):
+    interval = kwargs.get("interval", 5)
+    polls = kwargs.get("polls", None)
+    # layers are always upserted - a full rewrite would drop the other files
+    overwrite = kwargs.get("overwrite", "last")
+    if overwrite == "full":
+        overwrite = "last"
+
+    manifest = load_manifest()
+    seen = {}
+    failed = {}
+    poll = 0
+    print(f"watching\t{dir_path}")
+    try:
+        while polls == None or poll < polls:
+            poll += 1
+            fps = get_stable(dir_path, manifest, seen, **kwargs)
+            # failed files are retried only after they change again
+            fps = [fp for fp in fps if failed.get(fp, None) != seen[fp]]
+
+            if len(fps) > 0:
+                results = []
+                for fp, result, error in proc_files(fps, **kwargs):
+                    if error != None:
+                        print(f"\nfailed\t{fp}\n{error}")
+                        failed[fp] = seen[fp]
+                        manifest.pop(fp, None)
+                    else:
+                        print(f"processed\t{fp}")
+                        failed.pop(fp, None)
+                        update_manifest(manifest, result, **kwargs)
+                        results.append(result)
+
+                if len(results) > 0:
+                    try:
+                        export_gdf(results, overwrite=overwrite, crs=3857)
+                    except Exception as error:
+                        # e.g. a GeoPackage held open - retried on the next poll
+                        traceback.print_exc()
+                        for result in results:
+                            manifest.pop(result.fp_csv, None)
+                save_manifest(manifest)
+
+            if polls == None or poll < polls:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        print("\nwatch stopped")
+    return manifest
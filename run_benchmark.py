@@ -0,0 +1,35 @@
+import time
+import traceback
+
+
+def run_benchmark(**kwargs):
+    sizes = kwargs.get("sizes", (100, 1_000, 10_000, 100_000))
+    # the 1,000,000 point file takes a long time - run_benchmark(large=True)
+    if kwargs.get("large", False) == True:
+        sizes = (*sizes, 1_000_000)
+    try:
+        from py_mob.bench import bench_interpolation, bench_pipeline
+        from py_mob.get_ld import get_ld
+    except Exception as error:
+        traceback.print_exc()
+        input("Press ENTER to continue!")
+
+    # pipeline stages on synthetic files of growing size
+    stamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+    df = bench_pipeline(sizes, fp_out=f"output/bench/bench_pipeline_{stamp}.json")
+    table = df.pivot_table(index="stage", columns="n", values="wall", sort=False)
+    print(table.round(3).to_string())
+
+    # interpolation methods against kriging on the measured files
+    ld = get_ld("raw", ext=".csv")
+    if len(ld) > 0:
+        df_int = bench_interpolation(
+            ld["fp"], fp_out=f"output/bench/bench_interpolation_{stamp}.json"
+        )
+        print(df_int.to_string(index=False))
+    return df
+
+
+if __name__ == "__main__":
+    run_benchmark()
+    input("\n\nBenchmark finshed press ENTER to exit!")
@@ -2,40 +2,104 @@ import traceback
 
 
 def run_processing(**kwargs):
-    crange = kwargs.get("crange", None)
+    incremental = kwargs.get("incremental", True)
+    stream = kwargs.get("stream", False)
+    overwrite = kwargs.get("overwrite", "full")
+    profile = kwargs.get("profile", False)
     try:
-        from py_mob.meas_class import Meas
         from py_mob.database import export_gdf
-        from py_mob.get_ld import get_ld
+        from py_mob.get_ld import iter_ld
+        from py_mob.batch import proc_files
+        from py_mob.cache import (
+            load_manifest,
+            save_manifest,
+            is_current,
+            update_manifest,
+            load_result,
+            prune_manifest,
+            clear_variogram,
+        )
+        from py_mob.profiling import profile_stage, save_profile, print_profile
+        from py_mob.watch import watch_folder
     except Exception as error:
         traceback.print_exc()
         input("Press ENTER to continue!")
 
-    ld = get_ld("raw", ext=".csv")
+    # the run model is fitted once per run - a watch session counts as one run
+    if kwargs.get("grid", {}).get("variogram", None) == "run":
+        clear_variogram("run")
 
-    meas = []
-    n = len(ld)
-    i = 0
-    zfill = len(str(n))
-    if n > 0:
-        for fp in ld["fp"]:
-            i += 1
-            print(f"{str(i).zfill(zfill)}/{str(n).zfill(zfill)}")
+    if kwargs.get("watch", False) == True:
+        watch_folder("raw", **kwargs)
+        return []
+
+    ld = [entry.path for entry in iter_ld("raw", ext=".csv")]
+
+    if incremental == True:
+        manifest = load_manifest()
+    else:
+        manifest = {}
+
+    cached = []
+    fps = []
+    for fp in ld:
+        if is_current(fp, manifest, **kwargs):
+            cached.append(fp)
+        else:
+            fps.append(fp)
+
+    print(f"{len(cached)} file(s) up to date, {len(fps)} file(s) to process")
+
+    errors = []
+    stats = []
+
+    def iter_meas():
+        for fp in cached:
+            if overwrite != "full":
+                # already in the GeoPackages - only new results are upserted
+                continue
             try:
-                tmp = Meas(fp)
-                tmp = tmp.Proc()
-                if crange != None:
-                    tmp.cmin = crange[0]
-                    tmp.cmax = crange[1]
-                tmp = tmp.Export()
-                meas.append(tmp)
+                yield load_result(manifest, fp)
+                continue
             except Exception as error:
                 traceback.print_exc()
-                input("Press ENTER to continue!")
+            fps.append(fp)
 
-    export_gdf(meas, overwrite="full", crs=3857)
+        n = len(fps)
+        i = 0
+        zfill = len(str(n))
+        for fp, result, error in proc_files(fps, **kwargs):
+            i += 1
+            print(f"{str(i).zfill(zfill)}/{str(n).zfill(zfill)}\t{fp}")
+            if error != None:
+                errors.append((fp, error))
+                manifest.pop(fp, None)
+            else:
+                update_manifest(manifest, result, **kwargs)
+                stats.extend([{"fp": fp, **row} for row in result.stats])
+                yield result
 
-    input("\n\nProcessing finshed press ENTER to exit!")
+    # run_total covers processing and export_gdf - file stages come from the workers
+    run_stats = []
+    with profile_stage(run_stats, "run_total"):
+        export_gdf(iter_meas(), overwrite=overwrite, crs=3857, stream=stream)
+    stats.extend([{"fp": None, **row} for row in run_stats])
+
+    manifest = prune_manifest(manifest, ld)
+    save_manifest(manifest)
+
+    if profile == True:
+        print("\n\nprofile:")
+        print_profile(save_profile(stats))
 
+    if len(errors) > 0:
+        print(f"\n\n{len(errors)} file(s) failed:")
+        for fp, error in errors:
+            print(f"\n{fp}\n{error}")
 
-run_processing()
+    return errors
+
+
+if __name__ == "__main__":
+    run_processing()
+    input("\n\nProcessing finshed press ENTER to exit!")
@@ -0,0 +1,5 @@
+from run_processing import run_processing
+
+if __name__ == "__main__":
+    # processes new and changed files in raw/ until stopped with Ctrl+C
+    run_processing(watch=True, interval=5)
@@ -0,0 +1,86 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from py_mob.line import get_lines
+
+
+def get_lines_loop(df):
+    # reference - the two-loop implementation get_lines replaced
+    df["split_k"] = df["d_dst"] * (df["d_hdg"]) ** 2
+    df["split"] = 0
+    df.loc[df["split_k"] > 1000, "split"] = 1
+
+    mask = np.max(df[["dst_fwd", "dst_bck"]], axis=1) > 4
+    df.loc[mask, "split"] = 1
+
+    for i in range(1, len(df)):
+        if df["split"][i] == df["split"][i - 1]:
+            df.loc[i, "split"] = 0
+
+    l = 0
+    line = []
+    for s in df["split"]:
+        line.append(l)
+        if s == 1:
+            l += 1
+    df["line"] = line
+
+    return df
+
+
+def random_df(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 200))
+    df = pd.DataFrame(
+        {
+            "d_dst": rng.uniform(0, 3, n),
+            "d_hdg": rng.uniform(0, 60, n),
+            "dst_fwd": rng.uniform(0, 6, n),
+            "dst_bck": rng.uniform(0, 6, n),
+        }
+    )
+    # gaps at the start and end of the walk have no neighbour
+    df.loc[rng.random(n) < 0.05, "dst_fwd"] = np.nan
+    df.loc[rng.random(n) < 0.05, "dst_bck"] = np.nan
+    df.loc[rng.random(n) < 0.05, "d_hdg"] = np.nan
+    return df
+
+
+def walk_df(n_lines=6, per_line=40):
+    # boustrophedon walk - 0.5 m steps, 180 deg turns and a gap between lines
+    rows = []
+    for line in range(n_lines):
+        for k in range(per_line):
+            turn = k == 0 and line > 0
+            rows.append(
+                {
+                    "d_dst": 0.5,
+                    "d_hdg": 180.0 if turn else 2.0,
+                    "dst_fwd": 0.5 if k < per_line - 1 else 5.0,
+                    "dst_bck": 5.0 if turn else 0.5,
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+def check_equal(df):
+    expected = get_lines_loop(df.copy())
+    result = get_lines(df.copy())
+    assert result["split"].tolist() == expected["split"].tolist()
+    assert result["line"].tolist() == expected["line"].tolist()
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_get_lines_random(seed):
+    check_equal(random_df(seed))
+
+
+@pytest.mark.parametrize("n_lines,per_line", [(1, 1), (1, 10), (6, 40), (20, 3)])
+def test_get_lines_walk(n_lines, per_line):
+    check_equal(walk_df(n_lines, per_line))